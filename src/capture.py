@@ -1,62 +1,281 @@
+import json
 import os
-import tempfile
+import threading
+from fractions import Fraction
 from typing import Optional
-from .util import which, run_quiet, log
+from .util import which, run_quiet, run_output, log
 
 FFMPEG = which("ffmpeg")
 FFPROBE = which("ffprobe")
 
-def probe_stream(url: str, seconds: int = 3) -> bool:
+VAAPI_DEVICE = "/dev/dri/renderD128"
+HW_ENCODERS = ("h264_nvenc", "h264_vaapi", "h264_qsv")
+
+# Every clip must be exactly 1280x720 @ 30fps: the pusher stream-copies into a
+# single FLV session, which carries one AVC sequence header for the whole stream
+FIT_720P30 = "scale=1280:720:force_original_aspect_ratio=decrease,pad=1280:720:(ow-iw)/2:(oh-ih)/2,setsar=1,fps=30"
+
+def detect_h264_encoder() -> str:
+    """
+    Pick the first hardware H.264 encoder that is both compiled into ffmpeg
+    and actually usable on this host, falling back to libx264.
+    """
+    listing = run_output([FFMPEG, "-hide_banner", "-encoders"], timeout=10)
+    if listing is None:
+        return "libx264"
+
+    for enc in HW_ENCODERS:
+        if enc not in listing:
+            continue
+        # Being listed doesn't mean the GPU/driver (or preset support) is there:
+        # run a tiny encode with the exact arguments captures will use
+        hw_in, video_out = video_encode_args(enc)
+        cmd = [
+            FFMPEG, "-hide_banner", "-loglevel", "error",
+            *hw_in,
+            "-f", "lavfi", "-i", "testsrc=size=1920x1080:rate=25:duration=0.5",
+            *video_out,
+            "-f", "null", "-",
+        ]
+        if run_quiet(cmd, timeout=15) == 0:
+            return enc
+        log(f"[CAPTURE] {enc} is listed but failed a test encode, skipping")
+    return "libx264"
+
+def video_encode_args(encoder: str) -> tuple[list[str], list[str]]:
+    """
+    Return (input_args, output_args) for the video side of a clip encode:
+    fixed 1280x720 (letterboxed) at 30fps, ~900k, 2s GOP with an IDR at the
+    start of every clip.
+    """
+    rate = [
+        "-b:v", "900k",        # average bitrate target
+        "-maxrate", "1000k",   # cap
+        "-bufsize", "2000k",   # buffer (controls burstiness)
+    ]
+    gop = [
+        "-g", "60",            # 2s GOP at 30fps
+        "-force_key_frames", "expr:gte(t,n_forced*2)",  # clip starts on an IDR, safe to concat
+    ]
+    if encoder == "h264_nvenc":
+        return [], [
+            "-vf", FIT_720P30,
+            "-c:v", "h264_nvenc",
+            "-preset", "p4",
+            "-tune", "ll",
+            "-rc", "vbr",
+            *rate,
+            "-pix_fmt", "yuv420p",
+            *gop,
+            "-forced-idr", "1",
+            "-no-scenecut", "1",
+        ]
+    if encoder == "h264_vaapi":
+        return ["-vaapi_device", VAAPI_DEVICE], [
+            "-vf", f"{FIT_720P30},format=nv12,hwupload",  # letterbox on CPU, encode on GPU
+            "-c:v", "h264_vaapi",
+            *rate,
+            *gop,
+        ]
+    if encoder == "h264_qsv":
+        return [], [
+            "-vf", FIT_720P30,
+            "-c:v", "h264_qsv",
+            "-preset", "veryfast",
+            *rate,
+            "-pix_fmt", "nv12",    # qsv's native 4:2:0 layout
+            *gop,
+        ]
+    return [], [
+        "-vf", FIT_720P30,
+        "-c:v", "libx264",
+        "-preset", "veryfast",
+        "-tune", "zerolatency",
+        # No lookahead/B-frames; slice threads parallelize well on short clips
+        "-x264-params", "bframes=0:scenecut=0:rc-lookahead=0:sync-lookahead=0:sliced-threads=1",
+        *rate,
+        "-pix_fmt", "yuv420p",
+        *gop,
+        "-keyint_min", "60",
+        "-sc_threshold", "0",
+    ]
+
+_video_args: Optional[tuple[list[str], list[str]]] = None
+_video_args_lock = threading.Lock()
+
+def h264_video_args() -> tuple[list[str], list[str]]:
+    """
+    video_encode_args() for the detected encoder. Detection runs test encodes,
+    so it happens once, on first use (main() triggers it at boot), not at import.
+    """
+    global _video_args
+    with _video_args_lock:
+        if _video_args is None:
+            encoder = detect_h264_encoder()
+            log(f"[CAPTURE] Using H.264 encoder: {encoder}")
+            _video_args = video_encode_args(encoder)
+        return _video_args
+
+def input_args(url: str) -> list[str]:
+    """Bound input open/read time so a dead URL fails fast."""
+    return [
+        "-rw_timeout", "7000000",  # ~7s read timeout in microseconds
+        *(["-timeout", "5000000"] if url.startswith(("http://", "https://")) else []),  # rtmp: -timeout means listen
+        "-analyzeduration", "2000000",
+        "-probesize", "1000000",
+    ]
+
+def probe_stream(url: str, seconds: int = 3) -> Optional[dict]:
     """
-    Quick probe to confirm there's a video stream.
+    Quick probe of the first video and audio streams.
+    Returns {"video": {...}, "audio": {...} or None}, or None if there is no video.
     """
     cmd = [
         FFPROBE,
         "-v", "error",
-        "-select_streams", "v:0",
-        "-show_entries", "stream=codec_name",
-        "-of", "csv=p=0",
+        *input_args(url),
+        "-show_entries", "stream=codec_type,codec_name,profile,width,height,pix_fmt,avg_frame_rate,bit_rate,channels,sample_rate",
+        "-of", "json",
         url,
     ]
-    rc = run_quiet(cmd, timeout=seconds + 3)
-    return rc == 0
+    out = run_output(cmd, timeout=seconds + 3)
+    if out is None:
+        return None
+    try:
+        streams = json.loads(out).get("streams", [])
+    except ValueError:
+        return None
+    video = next((s for s in streams if s.get("codec_type") == "video"), None)
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), None)
+    if video is None:
+        return None
+    return {"video": video, "audio": audio}
+
+COPY_MAX_VIDEO_BPS = 1_000_000  # same cap as the encoder's -maxrate
 
-def capture_7s_reencode(url: str, out_path: str, seconds: int = 7) -> bool:
+def copied_clip_ok(path: str) -> bool:
+    """
+    Check a stream-copied clip actually starts with video. With -c copy ffmpeg
+    drops video until the first keyframe, so a long-GOP source can yield a clip
+    that is mostly (or entirely) audio; the first kept video packet is always
+    a keyframe, so it's enough to require video starting with the audio.
     """
-    Capture ~7 seconds and normalize:
-      - 720p, 30fps
+    cmd = [
+        FFPROBE,
+        "-v", "error",
+        "-show_entries", "stream=codec_type,start_time",
+        "-of", "json",
+        path,
+    ]
+    out = run_output(cmd, timeout=10)
+    if out is None:
+        return False
+    try:
+        starts = {s["codec_type"]: float(s["start_time"]) for s in json.loads(out).get("streams", [])}
+    except (ValueError, KeyError, TypeError):
+        return False
+    if "video" not in starts:
+        return False
+    return starts["video"] - min(starts.values()) <= 0.5
+
+# url -> is_target_format(), filled on first capture of each source
+_format_cache: dict[str, bool] = {}
+
+def clear_format_cache():
+    """Forget probed source formats (call when the playlist is reloaded)."""
+    _format_cache.clear()
+
+def is_target_format(info: dict) -> bool:
+    """
+    True if the source already matches what capture_7s_reencode would produce,
+    closely enough to be stream-copied next to encoded clips. An unknown video
+    bitrate (common for live HLS) counts as a mismatch.
+    """
+    v, a = info["video"], info["audio"]
+    if a is None:
+        return False
+    try:
+        fps = Fraction(v.get("avg_frame_rate", "0/1"))
+        bit_rate = int(v.get("bit_rate", ""))
+    except (ValueError, ZeroDivisionError):
+        return False
+    return (
+        v.get("codec_name") == "h264"
+        and v.get("width") == 1280
+        and v.get("height") == 720
+        and bit_rate <= COPY_MAX_VIDEO_BPS
+        and v.get("pix_fmt") == "yuv420p"
+        and fps == 30
+        and a.get("codec_name") == "aac"
+        and a.get("profile") == "LC"
+        and a.get("sample_rate") == "44100"
+        and a.get("channels") == 2
+    )
+
+def capture_7s_reencode(url: str, out_path: str, seconds: int = 7, threads: Optional[int] = None) -> bool:
+    """
+    Capture ~7 seconds and normalize (stream copy if the source already matches):
+      - 1280x720 (letterboxed), 30fps
       - H.264 (yuv420p), ~3Mbps
       - AAC 128k, 44.1kHz, stereo
       - Container: MPEG-TS
+    `threads` caps encoder threads to match the caller's CPU slice.
     """
-    # Write to temp then atomically move
-    fd, tmp_path = tempfile.mkstemp(prefix="clip_", suffix=".ts", dir=os.path.dirname(out_path))
-    os.close(fd)
-    os.unlink(tmp_path)  # ffmpeg will create it
+    # Write next to the (uniquely named) target, then atomically move
+    tmp_path = out_path + ".part"
 
-    cmd = [
-    FFMPEG,
-    "-hide_banner",
-    "-loglevel", "error",
-    "-rw_timeout", "7000000",  # ~7s read timeout in microseconds
-    "-i", url,
-    "-t", str(seconds),
-    "-vf", "scale=-2:720,fps=30",
-    "-c:v", "libx264",
-    "-preset", "veryfast",
-    "-b:v", "900k",        # average bitrate target
-    "-maxrate", "1000k",   # cap
-    "-bufsize", "2000k",   # buffer (controls burstiness)
-    "-pix_fmt", "yuv420p",
-    "-c:a", "aac",
-    "-b:a", "96k",         # smaller audio bitrate
-    "-ar", "44100",
-    "-ac", "2",
-    "-f", "mpegts",
-    tmp_path,
-]
+    # Probe only the first attempt on a source; afterwards ffmpeg's exit code
+    # is the bad-URL signal
+    copy = _format_cache.get(url)
+    if copy is None:
+        info = probe_stream(url)
+        if info is None:
+            return False  # unreachable or no video: skip without starting ffmpeg
+        copy = _format_cache[url] = is_target_format(info)
+
+    if copy:
+        # Already 1280x720p30 H.264/AAC-LC 44.1k stereo: stream copy, no encode
+        # (checked afterwards by copied_clip_ok, see there)
+        cmd = [
+            FFMPEG,
+            "-hide_banner",
+            "-loglevel", "error",
+            "-y",
+            *input_args(url),
+            "-i", url,
+            "-t", str(seconds),
+            "-map", "0:v:0",
+            "-map", "0:a:0",
+            "-c", "copy",
+            "-f", "mpegts",
+            tmp_path,
+        ]
+    else:
+        video_in, video_out = h264_video_args()
+        cmd = [
+            FFMPEG,
+            "-hide_banner",
+            "-loglevel", "error",
+            "-y",                      # overwrite a leftover .part instead of prompting
+            *input_args(url),
+            *video_in,
+            "-i", url,
+            "-t", str(seconds),
+            *video_out,
+            *(["-threads", str(threads)] if threads else []),
+            "-c:a", "aac",
+            "-b:a", "96k",         # smaller audio bitrate
+            "-ar", "44100",
+            "-ac", "2",
+            "-f", "mpegts",
+            tmp_path,
+        ]
 
     rc = run_quiet(cmd, timeout=seconds + 20)
+    if rc == 0 and copy and os.path.exists(tmp_path) and not copied_clip_ok(tmp_path):
+        # Long-GOP source: keyframes too sparse for short copies, encode it from now on
+        _format_cache[url] = False
+        rc = 1
     if rc == 0 and os.path.exists(tmp_path) and os.path.getsize(tmp_path) > 100_000:
         try:
             os.replace(tmp_path, out_path)
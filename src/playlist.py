@@ -1,5 +1,6 @@
 import os
 import random
+import re
 import requests
 from typing import List
 from .util import log
@@ -10,31 +11,37 @@ def load_blocklist(path: str = "blocklist.txt") -> List[str]:
     """
     if not os.path.exists(path):
         return []
+    out = []
     with open(path, "r", encoding="utf-8") as f:
-        return [
-            line.strip().lower()
-            for line in f
-            if line.strip() and not line.strip().startswith("#")
-        ]
+        for line in f:
+            s = line.strip()
+            if s and s[0] != "#":
+                out.append(s.lower())
+    return out
 
 def fetch_m3u_urls(m3u_url: str, timeout: int = 10, blocklist_path: str = "blocklist.txt") -> List[str]:
     try:
-        r = requests.get(m3u_url, timeout=timeout)
-        r.raise_for_status()
-
         blocklist = load_blocklist(blocklist_path)
-        raw_urls = [line.strip() for line in r.text.splitlines() if line and not line.startswith("#")]
+        # One alternation regex scans each URL once instead of once per entry
+        blocked = re.compile("|".join(map(re.escape, blocklist)), re.IGNORECASE) if blocklist else None
 
-        if blocklist:
-            raw_count = len(raw_urls)
-            urls = [u for u in raw_urls if all(b not in u.lower() for b in blocklist)]
-            filtered_out = raw_count - len(urls)
-            if filtered_out:
-                log(f"Filtered out {filtered_out} blocked URLs")
-        else:
-            urls = raw_urls
+        # Stream the playlist and filter as lines arrive, never holding the whole body
+        urls = []
+        filtered_out = 0
+        with requests.get(m3u_url, timeout=timeout, stream=True) as r:
+            r.raise_for_status()
+            r.encoding = r.encoding or "utf-8"
+            for line in r.iter_lines(chunk_size=1 << 16, decode_unicode=True):
+                u = line.strip()
+                if not u or u[0] == "#":
+                    continue
+                if blocked and blocked.search(u):
+                    filtered_out += 1
+                    continue
+                urls.append(u)
+        if filtered_out:
+            log(f"Filtered out {filtered_out} blocked URLs")
 
-        random.shuffle(urls)
         log(f"Playlist loaded: {len(urls)} URLs")
         return urls
     except Exception as e:
@@ -42,10 +49,11 @@ def fetch_m3u_urls(m3u_url: str, timeout: int = 10, blocklist_path: str = "block
         return []
     
 def rotate_candidates(cands: List[str]):
-    """Generator that yields random choices from the list forever."""
+    """Generator that yields the list in a fresh random order each pass, forever."""
     pool = list(cands)
     while True:
         if not pool:
             yield None
-        else:
-            yield random.choice(pool)
+            continue
+        random.shuffle(pool)
+        yield from pool
@@ -1,18 +1,22 @@
 #!/usr/bin/env python3
 import os
+import fcntl
+import signal
+import sys
 import threading
 import queue
 import time
 import stat
-import random
 import datetime
+import itertools
+from collections import deque
+from dataclasses import dataclass
 from pathlib import Path
 from typing import Optional
-import uuid
 
-from .util import ensure_dir, which, log, run_quiet
-from .playlist import fetch_m3u_urls
-from .capture import probe_stream, capture_7s_reencode
+from .util import ensure_dir, which, log, run_quiet, cpu_slices, start_log_writer
+from .playlist import fetch_m3u_urls, rotate_candidates
+from .capture import capture_7s_reencode, clear_format_cache, h264_video_args
 
 # ---------- CONFIG ----------
 ROOT = Path(__file__).resolve().parent.parent
@@ -26,74 +30,69 @@ MAX_QUEUE = 14
 MIN_QUEUE = 7
 WORKERS = 4
 STALE_SEC = 30           # Max age for queued clips
+STALE_NS = STALE_SEC * 1_000_000_000
 BUFFER_CLEANUP_SEC = 120 # Remove orphaned clips older than this
-CLEANUP_INTERVAL = 10    # Queue cleanup cadence
+PIPE_SIZE = 1 << 20      # FIFO capacity (capped by /proc/sys/fs/pipe-max-size)
 # ---------------------------
 
 FFMPEG = which("ffmpeg")
+_clip_ids = itertools.count()  # next() is atomic under the GIL, safe across workers
 
 # ---------- CLIP QUEUE ----------
+@dataclass(slots=True)
+class Clip:
+    path: Path
+    ts: int  # time.monotonic_ns() when queued; immune to wall-clock jumps
+
 class ClipQueue:
     def __init__(self, max_items: int):
-        self.q = queue.Queue(maxsize=max_items)
-        self.lock = threading.Lock()
+        self.max_items = max_items
+        self.dq: deque[Clip] = deque()
+        self.cv = threading.Condition()
         self.last_good: Optional[Path] = None
-        self.timestamps = {}
-        self._stop_event = threading.Event()
-        threading.Thread(target=self._cleanup_loop, daemon=True).start()
 
     def put(self, path: Path, timeout: Optional[int] = None):
-        self.q.put(path, timeout=timeout)
-        self.timestamps[path] = time.time()
+        with self.cv:
+            if not self.cv.wait_for(lambda: len(self.dq) < self.max_items, timeout=timeout):
+                raise queue.Full
+            self.dq.append(Clip(path, time.monotonic_ns()))
+            self.cv.notify_all()
 
     def get(self, timeout: Optional[int] = None) -> Optional[Path]:
-        try:
-            while True:
-                p = self.q.get(timeout=timeout)
-                age = time.time() - self.timestamps.pop(p, 0)
-                if age > STALE_SEC:
-                    log(f"[STALE] Discarding {p.name}, age={age:.1f}s")
-                    try: p.unlink(missing_ok=True)
-                    except Exception: pass
-                    continue
-                with self.lock:
-                    self.last_good = p
-                return p
-        except queue.Empty:
-            return None
+        while True:
+            with self.cv:
+                if not self.cv.wait_for(lambda: self.dq, timeout=timeout):
+                    return None
+                c = self.dq.popleft()
+                self.cv.notify_all()
+            age_ns = time.monotonic_ns() - c.ts
+            if age_ns > STALE_NS:
+                log(f"[STALE] Discarding {c.path.name}, age={age_ns / 1e9:.1f}s")
+                try: c.path.unlink(missing_ok=True)
+                except Exception: pass
+                continue
+            with self.cv:
+                self.last_good = c.path
+            return c.path
 
     def size(self) -> int:
-        return self.q.qsize()
+        with self.cv:
+            return len(self.dq)
+
+    def wait_size(self, pred, timeout: Optional[float] = None) -> int:
+        """Block until pred(size) holds (or timeout) and return the size."""
+        with self.cv:
+            self.cv.wait_for(lambda: pred(len(self.dq)), timeout=timeout)
+            return len(self.dq)
+
+    def paths(self) -> list[Path]:
+        with self.cv:
+            return [c.path for c in self.dq]
 
     def last(self) -> Optional[Path]:
-        with self.lock:
+        with self.cv:
             return self.last_good
 
-    def stop(self):
-        self._stop_event.set()
-
-    def _cleanup_loop(self):
-        while not self._stop_event.is_set():
-            now = time.time()
-            removed = 0
-            with self.q.mutex:
-                fresh_items = []
-                while self.q.queue:
-                    p = self.q.queue.popleft()
-                    age = now - self.timestamps.get(p, 0)
-                    if age > STALE_SEC:
-                        removed += 1
-                        self.timestamps.pop(p, None)
-                        try: p.unlink(missing_ok=True)
-                        except Exception: pass
-                    else:
-                        fresh_items.append(p)
-                for item in fresh_items:
-                    self.q.queue.append(item)
-            if removed:
-                log(f"[QUEUE CLEANUP] Removed {removed} stale clips")
-            time.sleep(CLEANUP_INTERVAL)
-
 # ---------- FIFO ----------
 def make_fifo():
     ensure_dir(BUFFER_DIR)
@@ -110,22 +109,29 @@ def make_fifo():
     os.mkfifo(FIFO_PATH)
 
 # ---------- PUSHER ----------
+def write_clip(fifo_fd: int, clip: Path):
+    """Copy one clip into the mux FIFO: in kernel space via splice on Linux, else a read/write loop."""
+    with open(clip, "rb") as f:
+        if hasattr(os, "splice"):  # Linux, Python 3.10+
+            src_fd = f.fileno()
+            # Ask for the whole clip per call; the kernel returns early as the pipe fills
+            count = max(os.fstat(src_fd).st_size, 1024*1024)
+            while os.splice(src_fd, fifo_fd, count) > 0: pass
+        else:
+            # sendfile(2) only targets sockets on macOS/BSD, so copy through userspace
+            for chunk in iter(lambda: f.read(1024*1024), b""):
+                view = memoryview(chunk)
+                while view:
+                    view = view[os.write(fifo_fd, view):]
+
 def reader_thread(rtmp_url: str, cq: ClipQueue):
+    # Clips are already normalized by capture_7s_reencode, so just remux to FLV
     push_cmd = [
         FFMPEG,
         "-re",
+        "-fflags", "+genpts",
         "-i", str(FIFO_PATH),
-        "-c:v", "libx264",
-        "-preset", "veryfast",
-        "-b:v", "900k",
-        "-maxrate", "1000k",
-        "-bufsize", "2000k",
-        "-pix_fmt", "yuv420p",
-        "-g", "60",
-        "-c:a", "aac",
-        "-b:a", "96k",
-        "-ar", "44100",
-        "-ac", "2",
+        "-c", "copy",
         "-f", "flv",
         rtmp_url,
     ]
@@ -141,23 +147,22 @@ def reader_thread(rtmp_url: str, cq: ClipQueue):
         try:
             with open(FIFO_PATH, "wb", buffering=0) as fifo:
                 log("[MUX] FIFO opened for writing")
+                fifo_fd = fifo.fileno()
+                try: fcntl.fcntl(fifo_fd, getattr(fcntl, "F_SETPIPE_SZ", 1031), PIPE_SIZE)
+                except OSError as e: log(f"[WARN] Could not grow FIFO to {PIPE_SIZE} bytes: {e}")
                 while True:
                     clip_path = cq.get(timeout=5)
                     if clip_path is None:
                         last = cq.last()
                         if last and last.exists():
                             log("[MUX] Queue empty, repeating last clip")
-                            with open(last, "rb") as f:
-                                for chunk in iter(lambda: f.read(1024*1024), b""):
-                                    fifo.write(chunk)
+                            write_clip(fifo_fd, last)
                             continue
                         time.sleep(1)
                         continue
 
                     if clip_path.exists():
-                        with open(clip_path, "rb") as f:
-                            for chunk in iter(lambda: f.read(1024*1024), b""):
-                                fifo.write(chunk)
+                        write_clip(fifo_fd, clip_path)
                         try: clip_path.unlink()
                         except Exception as e: log(f"[WARN] Could not delete {clip_path.name}: {e}")
                     else:
@@ -168,8 +173,14 @@ def reader_thread(rtmp_url: str, cq: ClipQueue):
             continue
 
 # ---------- WORKER ----------
-def worker_thread(name: str, holder: dict, cq: ClipQueue, stop_evt: threading.Event, pause_evt: threading.Event):
+def worker_thread(name: str, holder: dict, cq: ClipQueue, stop_evt: threading.Event, pause_evt: threading.Event,
+                  cpus: Optional[set[int]] = None):
+    # Pin this thread (pid 0 = calling thread on Linux); its ffmpeg children inherit the mask
+    if cpus:
+        try: os.sched_setaffinity(0, cpus)
+        except OSError as e: log(f"[WARN] {name}: could not pin to CPUs {sorted(cpus)}: {e}")
     duration_cycle = 0
+    source, candidates = None, None
     while not stop_evt.is_set():
         if pause_evt.is_set():
             time.sleep(2)
@@ -179,15 +190,15 @@ def worker_thread(name: str, holder: dict, cq: ClipQueue, stop_evt: threading.Ev
             time.sleep(2)
             continue
 
-        url = random.choice(urls)
-        if not probe_stream(url, seconds=3):
-            continue
+        if urls is not source:  # first pass or playlist reloaded
+            source, candidates = urls, rotate_candidates(urls)
+        url = next(candidates)
 
         clip_len = [5,7,11][duration_cycle]
         duration_cycle = (duration_cycle +1)%3
-        clip_path = BUFFER_DIR / f"clip_{uuid.uuid4().hex[:8]}.ts"
+        clip_path = BUFFER_DIR / f"clip_{os.getpid()}_{next(_clip_ids)}.ts"
 
-        ok = capture_7s_reencode(url, str(clip_path), seconds=clip_len)
+        ok = capture_7s_reencode(url, str(clip_path), seconds=clip_len, threads=len(cpus) if cpus else None)
         if ok and clip_path.exists():
             try: cq.put(clip_path, timeout=5)
             except queue.Full: clip_path.unlink(missing_ok=True)
@@ -195,59 +206,76 @@ def worker_thread(name: str, holder: dict, cq: ClipQueue, stop_evt: threading.Ev
             clip_path.unlink(missing_ok=True)
 
 # ---------- PLAYLIST RELOAD ----------
-def reload_playlist_at_midnight(holder: dict, stop_evt: threading.Event):
-    while not stop_evt.is_set():
-        now = datetime.datetime.now()
-        tomorrow = (now + datetime.timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
-        time.sleep((tomorrow - now).total_seconds())
-        if stop_evt.is_set(): break
-        try:
-            urls = fetch_m3u_urls((PLAYLIST_FILE).read_text().strip())
-            if urls: holder["urls"] = urls
-        except Exception as e:
-            log(f"[PLAYLIST] Reload error: {e}")
+def reload_playlist(holder: dict) -> bool:
+    try:
+        urls = fetch_m3u_urls((PLAYLIST_FILE).read_text().strip())
+        if urls:
+            holder["urls"] = urls
+            clear_format_cache()
+            return True
+    except Exception as e:
+        log(f"[PLAYLIST] Reload error: {e}")
+    return False
 
 # ---------- BUFFER CLEANUP ----------
-def cleanup_buffer(cq: ClipQueue, stop_evt: threading.Event, threshold: int = BUFFER_CLEANUP_SEC):
+def cleanup_buffer(cq: ClipQueue, holder: dict, stop_evt: threading.Event, threshold: int = BUFFER_CLEANUP_SEC):
+    # Also reloads the playlist on the first pass after midnight (robust to suspend/clock jumps)
+    last_reload = datetime.date.today()
     while not stop_evt.is_set():
-        queued = set()
-        with cq.q.mutex: queued.update(cq.q.queue)
+        today = datetime.date.today()
+        if today != last_reload and reload_playlist(holder):
+            last_reload = today  # on failure, retry next pass
+
+        queued = set(cq.paths())
         last = cq.last()
         if last: queued.add(last)
         removed = 0
-        for clip in BUFFER_DIR.glob("*.ts"):
-            if clip not in queued and clip != FIFO_PATH:
-                try: age = time.time() - clip.stat().st_mtime
-                except FileNotFoundError: continue
-                if age > threshold:
-                    try: clip.unlink(); removed +=1
-                    except Exception: pass
+        now = time.time()  # wall clock, to compare with file mtimes
+        # A scan failure must not kill this thread (it also drives playlist reloads)
+        try:
+            with os.scandir(BUFFER_DIR) as it:
+                for de in it:
+                    if not de.name.endswith((".ts", ".ts.part")) or de.name == FIFO_PATH.name: continue
+                    clip = Path(de.path)
+                    if clip in queued: continue
+                    try: age = now - de.stat().st_mtime
+                    except OSError: continue
+                    if age > threshold:
+                        try: clip.unlink(); removed +=1
+                        except Exception: pass
+        except OSError as e:
+            log(f"[BUFFER CLEANUP] Scan of {BUFFER_DIR} failed: {e}")
         if removed: log(f"[BUFFER CLEANUP] Removed {removed} orphaned clips")
         time.sleep(60)
 
 # ---------- BUFFER MONITOR ----------
 def buffer_monitor(cq: ClipQueue, pause_evt: threading.Event, stop_evt: threading.Event):
+    # Woken by put/get instead of polling; the timeout only lets stop_evt be noticed
     while not stop_evt.is_set():
-        buf_size = cq.size()
-        pause_evt.set() if buf_size >= MAX_QUEUE else pause_evt.clear() if buf_size <= MIN_QUEUE else None
-        time.sleep(2)
+        if pause_evt.is_set():
+            if cq.wait_size(lambda n: n <= MIN_QUEUE, timeout=5) <= MIN_QUEUE: pause_evt.clear()
+        else:
+            if cq.wait_size(lambda n: n >= MAX_QUEUE, timeout=5) >= MAX_QUEUE: pause_evt.set()
 
 # ---------- MAIN ----------
 def main():
+    start_log_writer()
+    # systemd/docker stop with SIGTERM; exit normally so atexit flushes the log queue
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
     ensure_dir(BUFFER_DIR)
     rtmp_url = (RTMP_FILE).read_text().strip()
     if not rtmp_url.startswith("rtmp://"): raise RuntimeError("youtube_rtmp.txt must contain a valid RTMP URL")
 
+    h264_video_args()  # detect the encoder up front rather than in the first worker
     holder = {"urls": fetch_m3u_urls((PLAYLIST_FILE).read_text().strip())}
     cq = ClipQueue(max_items=MAX_QUEUE)
     stop_evt, pause_evt = threading.Event(), threading.Event()
 
-    threading.Thread(target=reload_playlist_at_midnight, args=(holder, stop_evt), daemon=True).start()
     threading.Thread(target=buffer_monitor, args=(cq, pause_evt, stop_evt), daemon=True).start()
-    threading.Thread(target=cleanup_buffer, args=(cq, stop_evt), daemon=True).start()
+    threading.Thread(target=cleanup_buffer, args=(cq, holder, stop_evt), daemon=True).start()
 
-    for i in range(WORKERS):
-        threading.Thread(target=worker_thread, args=(f"W{i+1}", holder, cq, stop_evt, pause_evt), daemon=True).start()
+    for i, cpus in enumerate(cpu_slices(WORKERS)):
+        threading.Thread(target=worker_thread, args=(f"W{i+1}", holder, cq, stop_evt, pause_evt, cpus), daemon=True).start()
 
     log(f"[BOOT] Warming buffer until {MIN_QUEUE} clips ready...")
     while cq.size() < MIN_QUEUE: time.sleep(1)
@@ -1,7 +1,11 @@
+import atexit
+import logging
+import logging.handlers
 import os
+import queue
 import shutil
 import subprocess
-import time
+import sys
 
 def ensure_dir(p: str):
     os.makedirs(p, exist_ok=True)
@@ -12,17 +16,68 @@ def which(bin_name: str) -> str:
         raise RuntimeError(f"Required binary '{bin_name}' not found in PATH")
     return path
 
+def cpu_slices(n: int) -> list[set[int] | None]:
+    """
+    Split this process's allowed CPUs into n contiguous blocks (neighbouring
+    cores share a node/CCX); the last block takes the remainder. With fewer
+    CPUs than n, blocks are single CPUs reused round-robin. None where unsupported.
+    """
+    if not hasattr(os, "sched_getaffinity"):
+        return [None] * n
+    cpus = sorted(os.sched_getaffinity(0))
+    if len(cpus) < n:
+        return [{cpus[i % len(cpus)]} for i in range(n)]
+    k = len(cpus) // n
+    return [set(cpus[i*k:(i+1)*k]) for i in range(n - 1)] + [set(cpus[(n-1)*k:])]
+
 def run_quiet(cmd: list[str], timeout: int | None = None) -> int:
     try:
         proc = subprocess.run(
             cmd,
             stdout=subprocess.DEVNULL,
             stderr=subprocess.DEVNULL,
+            # With close_fds off (our fds are non-inheritable anyway, PEP 446),
+            # CPython launches via posix_spawn instead of fork+exec
+            close_fds=False,
             timeout=timeout,
         )
         return proc.returncode
     except subprocess.TimeoutExpired:
         return 124  # conventional timeout code
 
+def run_output(cmd: list[str], timeout: int | None = None) -> str | None:
+    """Like run_quiet, but return stdout on success and None on any failure."""
+    try:
+        proc = subprocess.run(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            close_fds=False,  # posix_spawn, see run_quiet
+            timeout=timeout,
+            text=True,
+        )
+    except subprocess.TimeoutExpired:
+        return None
+    return proc.stdout if proc.returncode == 0 else None
+
+# log() goes straight to stdout until start_log_writer() moves writing to a
+# background QueueListener, so callers only enqueue records
+_log_handler = logging.StreamHandler(sys.stdout)
+_log_handler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s", "%Y-%m-%d %H:%M:%S"))
+_logger = logging.getLogger("streamer")
+_logger.setLevel(logging.INFO)
+_logger.propagate = False
+_logger.addHandler(_log_handler)
+
+def start_log_writer() -> logging.handlers.QueueListener:
+    """Switch log() to a queue drained by a writer thread; stopped (flushed) at exit."""
+    q: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(q, _log_handler)
+    _logger.removeHandler(_log_handler)
+    _logger.addHandler(logging.handlers.QueueHandler(q))
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
 def log(msg: str):
-    print(time.strftime("[%Y-%m-%d %H:%M:%S]"), msg, flush=True)
+    _logger.info(msg)
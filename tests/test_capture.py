@@ -0,0 +1,55 @@
+import shutil
+
+import pytest
+
+if not (shutil.which("ffmpeg") and shutil.which("ffprobe")):
+    pytest.skip("ffmpeg/ffprobe not in PATH", allow_module_level=True)
+
+from src.capture import is_target_format
+
+VIDEO = {
+    "codec_name": "h264",
+    "width": 1280,
+    "height": 720,
+    "pix_fmt": "yuv420p",
+    "avg_frame_rate": "30/1",
+    "bit_rate": "800000",
+}
+AUDIO = {"codec_name": "aac", "profile": "LC", "sample_rate": "44100", "channels": 2}
+
+
+def test_matching_source_is_copyable():
+    assert is_target_format({"video": VIDEO, "audio": AUDIO})
+
+
+@pytest.mark.parametrize("video_patch", [
+    {"width": 960},
+    {"height": 1080},
+    {"codec_name": "hevc"},
+    {"pix_fmt": "yuv420p10le"},
+    {"avg_frame_rate": "25/1"},
+    {"avg_frame_rate": "0/0"},
+    {"bit_rate": "4000000"},
+    {"bit_rate": "N/A"},
+])
+def test_video_mismatch_is_not_copyable(video_patch):
+    assert not is_target_format({"video": {**VIDEO, **video_patch}, "audio": AUDIO})
+
+
+def test_unknown_video_bitrate_is_not_copyable():
+    video = {k: v for k, v in VIDEO.items() if k != "bit_rate"}
+    assert not is_target_format({"video": video, "audio": AUDIO})
+
+
+@pytest.mark.parametrize("audio_patch", [
+    {"profile": "HE-AAC"},
+    {"codec_name": "mp3"},
+    {"sample_rate": "48000"},
+    {"channels": 6},
+])
+def test_audio_mismatch_is_not_copyable(audio_patch):
+    assert not is_target_format({"video": VIDEO, "audio": {**AUDIO, **audio_patch}})
+
+
+def test_missing_audio_is_not_copyable():
+    assert not is_target_format({"video": VIDEO, "audio": None})
@@ -0,0 +1,86 @@
+import queue
+import shutil
+import threading
+import time
+
+import pytest
+
+if not (shutil.which("ffmpeg") and shutil.which("ffprobe")):
+    pytest.skip("ffmpeg/ffprobe not in PATH", allow_module_level=True)
+
+from src import streamer
+from src.streamer import ClipQueue
+
+
+def make_clip(tmp_path, name):
+    p = tmp_path / name
+    p.write_bytes(b"x")
+    return p
+
+
+def test_put_raises_full_at_capacity(tmp_path):
+    cq = ClipQueue(max_items=2)
+    cq.put(make_clip(tmp_path, "a.ts"))
+    cq.put(make_clip(tmp_path, "b.ts"))
+    with pytest.raises(queue.Full):
+        cq.put(make_clip(tmp_path, "c.ts"), timeout=0.05)
+    assert cq.size() == 2
+
+
+def test_get_is_fifo_and_tracks_last(tmp_path):
+    cq = ClipQueue(max_items=3)
+    a, b = make_clip(tmp_path, "a.ts"), make_clip(tmp_path, "b.ts")
+    cq.put(a)
+    cq.put(b)
+    assert cq.paths() == [a, b]
+    assert cq.get(timeout=1) == a
+    assert cq.last() == a
+    assert cq.get(timeout=1) == b
+    assert cq.get(timeout=0.05) is None
+    assert cq.last() == b
+
+
+def test_get_discards_stale_clips(tmp_path, monkeypatch):
+    monkeypatch.setattr(streamer, "STALE_NS", 0)
+    cq = ClipQueue(max_items=3)
+    clip = make_clip(tmp_path, "old.ts")
+    cq.put(clip)
+    assert cq.get(timeout=0.05) is None
+    assert not clip.exists()
+    assert cq.last() is None
+
+
+def test_wait_size_wakes_on_put(tmp_path):
+    cq = ClipQueue(max_items=3)
+    threading.Timer(0.05, cq.put, args=(make_clip(tmp_path, "a.ts"),)).start()
+    assert cq.wait_size(lambda n: n >= 1, timeout=2) == 1
+
+
+def test_wait_size_times_out_with_current_size():
+    cq = ClipQueue(max_items=3)
+    assert cq.wait_size(lambda n: n >= 1, timeout=0.05) == 0
+
+
+def test_buffer_monitor_pauses_and_resumes(tmp_path, monkeypatch):
+    monkeypatch.setattr(streamer, "MAX_QUEUE", 3)
+    monkeypatch.setattr(streamer, "MIN_QUEUE", 1)
+    cq = ClipQueue(max_items=3)
+    pause_evt, stop_evt = threading.Event(), threading.Event()
+    t = threading.Thread(target=streamer.buffer_monitor, args=(cq, pause_evt, stop_evt), daemon=True)
+    t.start()
+    try:
+        for i in range(3):
+            cq.put(make_clip(tmp_path, f"{i}.ts"))
+        assert pause_evt.wait(1)
+
+        cq.get(timeout=1)  # 2 left: still above MIN_QUEUE
+        time.sleep(0.1)
+        assert pause_evt.is_set()
+
+        cq.get(timeout=1)  # 1 left: resume
+        deadline = time.monotonic() + 1
+        while pause_evt.is_set() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert not pause_evt.is_set()
+    finally:
+        stop_evt.set()
@@ -0,0 +1,20 @@
+from itertools import islice
+
+from src.playlist import rotate_candidates
+
+
+def test_rotate_candidates_yields_full_permutation_each_pass():
+    urls = [f"http://example.com/{i}.m3u8" for i in range(10)]
+    gen = rotate_candidates(urls)
+    for _ in range(3):
+        assert sorted(islice(gen, len(urls))) == sorted(urls)
+
+
+def test_rotate_candidates_does_not_mutate_input():
+    urls = ["a", "b", "c", "d"]
+    list(islice(rotate_candidates(urls), 8))
+    assert urls == ["a", "b", "c", "d"]
+
+
+def test_rotate_candidates_empty_yields_none():
+    assert list(islice(rotate_candidates([]), 3)) == [None, None, None]
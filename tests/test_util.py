@@ -0,0 +1,23 @@
+import os
+
+from src.util import cpu_slices
+
+
+def test_cpu_slices_contiguous_blocks(monkeypatch):
+    monkeypatch.setattr(os, "sched_getaffinity", lambda pid: set(range(16)), raising=False)
+    assert cpu_slices(4) == [{0, 1, 2, 3}, {4, 5, 6, 7}, {8, 9, 10, 11}, {12, 13, 14, 15}]
+
+
+def test_cpu_slices_last_block_takes_remainder(monkeypatch):
+    monkeypatch.setattr(os, "sched_getaffinity", lambda pid: set(range(10)), raising=False)
+    assert cpu_slices(4) == [{0, 1}, {2, 3}, {4, 5}, {6, 7, 8, 9}]
+
+
+def test_cpu_slices_fewer_cpus_than_workers(monkeypatch):
+    monkeypatch.setattr(os, "sched_getaffinity", lambda pid: {0, 1, 2}, raising=False)
+    assert cpu_slices(4) == [{0}, {1}, {2}, {0}]
+
+
+def test_cpu_slices_unsupported_platform(monkeypatch):
+    monkeypatch.delattr(os, "sched_getaffinity", raising=False)
+    assert cpu_slices(3) == [None, None, None]